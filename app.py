@@ -1,193 +1,562 @@
+import os
+
+# Tesseract's internal OpenMP threading fights with our own page-level
+# parallelism, so limit each Tesseract process to a single thread. This must
+# run before any native library is imported: libgomp reads it once on load.
+os.environ["OMP_THREAD_LIMIT"] = "1"
+
 import streamlit as st
 
 # IMPORTANT: set_page_config must be the first st command in the script
 st.set_page_config(page_title="Document Q&A Extractor", page_icon="📄", layout="wide")
 
-import os
-import tempfile
+import asyncio
+import hashlib
+import io
+import httpx
+import json
+import multiprocessing
+import zipfile
+from xml.etree import ElementTree
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-import pytesseract
-from pdf2image import convert_from_path
-import pdfplumber 
+from PIL import ImageOps
+import pypdfium2 as pdfium
 import re
 from docx import Document
 import sys
-import subprocess
-import importlib
+import importlib.metadata
+import threading
+import time
+from workers import extract_one_page, init_ocr_worker, ocr_one_page, open_worker_pdf, read_page_text
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
-# First try to import dotenv
+# google-re2 matches in linear time, which helps on very long documents;
+# fall back to the standard library engine when it isn't installed
 try:
-    from dotenv import load_dotenv
-    # Load environment variables from .env file
-    load_dotenv()
+    import re2 as question_re
 except ImportError:
-    st.sidebar.warning("python-dotenv not found. Installing...")
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "python-dotenv"])
-    from dotenv import load_dotenv
-    load_dotenv()
-    st.sidebar.success("python-dotenv installed successfully.")
+    question_re = re
+
+OCR_LANGUAGE = "eng"
+# 150 DPI grayscale is plenty for printed text; Tesseract's runtime grows
+# roughly with pixel count, so this is about half the work of 200 DPI RGB.
+OCR_DPI = 150
+OCR_WORKERS = os.cpu_count() or 1
+# Pages checked for selectable text before deciding a PDF is scanned
+SCAN_PROBE_PAGES = 2
+# PDFium extracts text at roughly 1.5 ms per page, while each spawned worker
+# takes about 0.5 s to start (it re-imports the app and Streamlit) and gets its
+# own copy of the PDF. Measured break-even is several hundred pages even with
+# ideal scaling, so only very long documents are split across processes.
+PARALLEL_EXTRACTION_MIN_PAGES = 1000
+# Start worker processes fresh rather than forking the multi-threaded
+# Streamlit server, whose other threads may hold locks mid-call
+WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
+# A capitalised sentence ending in "?"; may wrap across lines
+QUESTION_PATTERN = question_re.compile(r"[A-Z][^?.!]*\?")
+
+# WordprocessingML namespaces used when reading word/document.xml directly
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC_NS = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+# Field codes, tracked deletions, and the legacy copy Word writes of text
+# boxes and other AlternateContent (the mc:Choice copy is kept)
+DOCX_SKIPPED_TAGS = {W_NS + "instrText", W_NS + "delText", MC_NS + "Fallback"}
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Upper bound on GPT requests in flight at once while answering questions
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "10"))
+# Hold back new requests once the API reports fewer than this many left
+RATE_LIMIT_REMAINING_THRESHOLD = 2
+# Extracted texts kept in memory, most recently used first
+DOCUMENT_CACHE_ENTRIES = 32
 
 # Initialize session state for API key
 if 'api_key' not in st.session_state:
     st.session_state.api_key = None
 
-# Check if OpenAI is installed and install the correct version if needed
-def check_openai_version():
+# Batch API job awaiting results, if any
+if 'batch_job' not in st.session_state:
+    st.session_state.batch_job = None
+
+# Installed package versions can't change while the app runs, so look them up
+# once per process instead of on every rerun
+@st.cache_resource(show_spinner=False)
+def get_openai_version():
     try:
-        import openai
-        current_version = openai.__version__
-        st.sidebar.info(f"OpenAI version: {current_version}")
-        if not current_version.startswith("0.28"):
-            st.sidebar.warning("OpenAI version mismatch. Installing compatible version...")
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "--force-reinstall", "openai==0.28.0"])
-            st.sidebar.success("OpenAI 0.28.0 installed. Please refresh the page.")
-            st.stop()
-    except ImportError:
-        st.sidebar.warning("OpenAI not found. Installing compatible version...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "openai==0.28.0"])
-        st.sidebar.success("OpenAI 0.28.0 installed. Please refresh the page.")
+        return importlib.metadata.version("openai")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+# Check that a compatible OpenAI package is installed. Dependencies are pinned
+# in requirements.txt rather than installed while the app is running.
+def check_openai_version():
+    current_version = get_openai_version()
+    if current_version is None:
+        st.error("OpenAI package not found. Install the dependencies with `pip install -r requirements.txt`.")
         st.stop()
-    
-    # Import after ensuring the correct version
+    st.sidebar.info(f"OpenAI version: {current_version}")
+    if int(current_version.split(".")[0]) < 1:
+        st.error(f"OpenAI {current_version} is not supported; version 1.x is required. Run `pip install -r requirements.txt`.")
+        st.stop()
+
     import openai
     return openai
 
-# Set Tesseract path based on operating system
+# Probe libtesseract once per process; returns (status, version)
+@st.cache_resource(show_spinner=False)
+def detect_tesseract():
+    if tesserocr is None:
+        return "missing", None
+    try:
+        _, languages = tesserocr.get_languages()
+        if OCR_LANGUAGE not in languages:
+            return "no_language", None
+        version = tesserocr.tesseract_version().split()
+        return "ok", version[1] if len(version) > 1 else ""
+    except Exception:
+        return "broken", None
+
+# Why OCR is unavailable, for each failing detect_tesseract() status
+TESSERACT_PROBLEMS = {
+    "missing": "Tesseract OCR not found.",
+    "no_language": f"Tesseract language data '{OCR_LANGUAGE}' not installed.",
+    "broken": "Tesseract OCR found but not working properly.",
+}
+
+# Check that tesserocr can load libtesseract and the English language data
 def setup_tesseract():
-    tesseract_found = False
-    if os.name == "nt":  # Windows
-        tesseract_path = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-        if os.path.exists(tesseract_path):
-            pytesseract.pytesseract.tesseract_cmd = tesseract_path
-            tesseract_found = True
-        else:
-            st.sidebar.warning("⚠️ Tesseract OCR not found in default Windows location.")
+    status, version = detect_tesseract()
+    if status in TESSERACT_PROBLEMS:
+        st.sidebar.warning(f"⚠️ {TESSERACT_PROBLEMS[status]} OCR functionality will not work.")
+    if status == "missing":
+        if os.name == "nt":  # Windows
             st.sidebar.markdown("""
             Please install Tesseract OCR:
             1. Download from: https://github.com/UB-Mannheim/tesseract/wiki
-            2. Install and ensure it's in your PATH
+            2. Install it, then `pip install tesserocr`
             """)
-    else:  # macOS or Linux
-        try:
-            # Try to find tesseract in the path
-            tesseract_cmd = subprocess.run(["which", "tesseract"], 
-                                           capture_output=True, 
-                                           text=True, 
-                                           check=True).stdout.strip()
-            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
-            tesseract_found = True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            # If not found, try default path
-            default_path = "/usr/bin/tesseract"
-            if os.path.exists(default_path):
-                pytesseract.pytesseract.tesseract_cmd = default_path
-                tesseract_found = True
-            else:
-                st.sidebar.warning("⚠️ Tesseract OCR not found. OCR functionality will not work.")
-                if os.name == "posix" and "darwin" in sys.platform:  # macOS
-                    st.sidebar.markdown("""
-                    Please install Tesseract OCR:
-                    ```bash
-                    brew install tesseract
-                    ```
-                    """)
-                else:  # Linux
-                    st.sidebar.markdown("""
-                    Please install Tesseract OCR:
-                    ```bash
-                    sudo apt-get install -y tesseract-ocr
-                    ```
-                    """)
-    
-    # Verify installation if tesseract is found
-    if tesseract_found:
-        try:
-            version = subprocess.run([pytesseract.pytesseract.tesseract_cmd, "--version"], 
-                                     capture_output=True, 
-                                     text=True).stdout
-            st.sidebar.success(f"✅ Tesseract OCR found: {version.split()[1] if version else ''}")
-        except Exception:
-            st.sidebar.warning("⚠️ Tesseract OCR found but not working properly.")
-    
-    return tesseract_found
+        elif "darwin" in sys.platform:  # macOS
+            st.sidebar.markdown("""
+            Please install Tesseract OCR:
+            ```bash
+            brew install tesseract
+            pip install tesserocr
+            ```
+            """)
+        else:  # Linux
+            st.sidebar.markdown("""
+            Please install Tesseract OCR:
+            ```bash
+            sudo apt-get install -y tesseract-ocr libtesseract-dev libleptonica-dev
+            pip install tesserocr
+            ```
+            """)
+    elif status == "ok":
+        st.sidebar.success(f"✅ Tesseract OCR found: {version}")
+
+    return status == "ok"
+
+class ExtractionError(Exception):
+    """Raised when text can't be extracted from an uploaded document."""
+
+def binarize_image(image):
+    # Stretch contrast, then threshold to pure black/white so Tesseract can
+    # skip its own binarization pass on noisy grayscale scans
+    image = ImageOps.autocontrast(image.convert("L"))
+    return image.point(lambda p: 0 if p < 128 else 255, "1")
+
+# PDFium is not thread-safe, even across documents, and Streamlit runs each
+# session's script in its own thread; every in-process PDFium call goes
+# through this one process-wide lock
+@st.cache_resource(show_spinner=False)
+def get_pdfium_lock():
+    return threading.Lock()
 
 # Functions for text extraction
-def extract_text_with_ocr(pdf_path):
+# Kept warm for the life of the server process, so each worker loads the
+# Tesseract language model once instead of on every upload
+@st.cache_resource(show_spinner=False)
+def get_ocr_pool():
+    return ProcessPoolExecutor(
+        max_workers=OCR_WORKERS,
+        mp_context=WORKER_CONTEXT,
+        initializer=init_ocr_worker,
+        initargs=(OCR_LANGUAGE,),
+    )
+
+def iter_ocr_texts(pdf, page_count, executor):
+    # PDFium isn't thread-safe, so pages are rendered here under the PDFium
+    # lock and only the OCR runs on the pool. Keeping a couple of pages per
+    # worker in flight bounds memory while results are still yielded in order.
+    pending = deque()
     try:
-        # First check if tesseract is available
-        if not hasattr(pytesseract.pytesseract, 'tesseract_cmd') or not os.path.exists(pytesseract.pytesseract.tesseract_cmd):
-            st.error("Tesseract OCR not available. Cannot process scanned document.")
-            return ""
-            
-        images = convert_from_path(pdf_path)
-        full_text = ""
-        with st.progress(0) as progress_bar:
-            for i, image in enumerate(images):
-                full_text += pytesseract.image_to_string(image) + "\n"
-                progress_bar.progress((i + 1) / len(images))
-        return full_text
+        for i in range(page_count):
+            with get_pdfium_lock():
+                page = pdf[i]
+                bitmap = page.render(scale=OCR_DPI / 72, grayscale=True)
+                # Binarizing copies the pixels out of the PDFium bitmap
+                image = binarize_image(bitmap.to_pil())
+                bitmap.close()
+                page.close()
+            pending.append(executor.submit(ocr_one_page, image))
+            if len(pending) >= OCR_WORKERS * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # The pool outlives this document, so drop any queued pages
+        for future in pending:
+            future.cancel()
+
+def extract_text_with_ocr(pdf_bytes):
+    # Don't start the pool when its workers are bound to fail loading Tesseract
+    status, _ = detect_tesseract()
+    if status != "ok":
+        raise ExtractionError(f"{TESSERACT_PROBLEMS[status]} Cannot process scanned document.")
+
+    try:
+        # Render pages in-process from a single parsed document instead of
+        # spawning pdftoppm, which re-reads the file from disk
+        with get_pdfium_lock():
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            page_count = len(pdf)
+        try:
+            page_texts = []
+            # Pages are OCR'd in parallel by the warm worker pool, each worker
+            # holding its own PyTessBaseAPI
+            with st.progress(0) as progress_bar:
+                for i, page_text in enumerate(iter_ocr_texts(pdf, page_count, get_ocr_pool())):
+                    page_texts.append(page_text + "\n")
+                    progress_bar.progress((i + 1) / page_count)
+            return "".join(page_texts)
+        finally:
+            with get_pdfium_lock():
+                pdf.close()
     except Exception as e:
-        st.error(f"Error processing PDF with OCR: {str(e)}")
+        if isinstance(e, BrokenProcessPool):
+            # A worker died (or failed to load Tesseract); start a fresh pool next time
+            get_ocr_pool.clear()
         st.info("If this is a scanned document, please make sure Tesseract OCR is properly installed.")
-        return ""
+        raise ExtractionError(f"Error processing PDF with OCR: {str(e)}") from e
+
+def iter_page_texts(pdf, pdf_bytes, start_page, end_page):
+    pages = range(start_page, end_page)
+    if len(pages) < PARALLEL_EXTRACTION_MIN_PAGES:
+        for i in pages:
+            with get_pdfium_lock():
+                text = read_page_text(pdf, i)
+            yield text
+        return
 
-def extract_text_from_pdf(pdf_path):
-    text = ""
+    # Pages are independent, so spread large documents across processes.
+    # Each worker receives the document bytes once and opens its own copy.
+    workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=WORKER_CONTEXT,
+        initializer=open_worker_pdf,
+        initargs=(pdf_bytes,),
+    ) as executor:
+        yield from executor.map(
+            extract_one_page,
+            pages,
+            chunksize=max(1, len(pages) // (workers * 4)),
+        )
+
+def extract_text_from_pdf(pdf_bytes, start_page=0, max_pages=None):
+    parts = []
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with get_pdfium_lock():
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            total_pages = len(pdf)
+        try:
+            end_page = total_pages if max_pages is None else min(total_pages, start_page + max_pages)
+            page_count = end_page - start_page
+            if page_count <= 0:
+                return ""
             with st.progress(0) as progress_bar:
-                for i, page in enumerate(pdf.pages):
-                    extracted_text = page.extract_text()
+                # PDFium's raw text extraction skips pdfplumber's layout analysis
+                for i, extracted_text in enumerate(iter_page_texts(pdf, pdf_bytes, start_page, end_page)):
                     if extracted_text:
-                        text += extracted_text + "\n"
-                    progress_bar.progress((i + 1) / len(pdf.pages))
+                        parts.append(extracted_text + "\n")
+                    progress_bar.progress((i + 1) / page_count)
+        finally:
+            with get_pdfium_lock():
+                pdf.close()
     except Exception as e:
-        st.error(f"Error extracting text from PDF: {str(e)}")
-    return text
+        raise ExtractionError(f"Error extracting text from PDF: {str(e)}") from e
+    return "".join(parts)
 
-def extract_text_from_docx(docx_path):
+def collect_docx_text(element, parts):
+    for child in element:
+        tag = child.tag
+        if tag in DOCX_SKIPPED_TAGS:
+            continue
+        if tag == W_NS + "t":
+            parts.append(child.text or "")
+        elif tag == W_NS + "tab":
+            # Only a run's tab is text; w:tab under w:tabs defines a tab stop
+            if element.tag == W_NS + "r":
+                parts.append("\t")
+        elif tag in (W_NS + "br", W_NS + "cr"):
+            parts.append("\n")
+        else:
+            collect_docx_text(child, parts)
+            if tag == W_NS + "p":
+                parts.append("\n")
+
+def extract_text_from_docx(docx_bytes):
     try:
-        doc = Document(docx_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        return text
+        # Pull the text straight out of the document XML instead of building
+        # python-docx's full paragraph/run object model
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as archive:
+            root = ElementTree.fromstring(archive.read("word/document.xml"))
+        parts = []
+        collect_docx_text(root, parts)
+        return "".join(parts)
     except Exception as e:
-        st.error(f"Error extracting text from DOCX: {str(e)}")
-        return ""
+        raise ExtractionError(f"Error extracting text from DOCX: {str(e)}") from e
 
-def get_document_text(file_path, file_type):
+def get_document_text(file_bytes, file_type):
     if file_type == "pdf":
-        text = extract_text_from_pdf(file_path)
+        # Only parse the first few pages to decide, so scanned PDFs go
+        # straight to OCR without a full text-extraction pass
+        text = extract_text_from_pdf(file_bytes, max_pages=SCAN_PROBE_PAGES)
         if len(text.strip()) < 50:  # If text is too small, assume it's a scanned PDF
             st.info("PDF appears to be scanned. Using OCR...")
-            return extract_text_with_ocr(file_path)
+            return extract_text_with_ocr(file_bytes)
         else:
             st.info("PDF has selectable text. Extracting directly...")
-            return text
+            return text + extract_text_from_pdf(file_bytes, start_page=SCAN_PROBE_PAGES)
     elif file_type == "docx":
         st.info("Processing DOCX file...")
-        return extract_text_from_docx(file_path)
+        return extract_text_from_docx(file_bytes)
     return ""
 
+@st.cache_data(show_spinner=False, max_entries=DOCUMENT_CACHE_ENTRIES)
+def get_cached_document_text(file_hash, file_type, _file_bytes):
+    # Cached on the SHA-256 of the upload, so re-uploading the same document
+    # skips parsing and OCR without Streamlit hashing the raw bytes again.
+    # Extraction failures raise, so they are never cached and a retry reruns.
+    return get_document_text(_file_bytes, file_type)
+
 def extract_questions(text):
-    question_pattern = r"([A-Z][^?.!]*\?)"
-    questions = re.findall(question_pattern, text)
-    filtered_questions = [q.strip() for q in questions if len(q.split()) > 2]
-    return filtered_questions
+    if "?" not in text:
+        return []
+    questions = []
+    for match in QUESTION_PATTERN.finditer(text):
+        # Collapse line wraps inside the question and keep ones of at least three words
+        words = match.group().split()
+        if len(words) > 2:
+            questions.append(" ".join(words))
+    return questions
+
+def is_rate_limit_error(error):
+    # insufficient_quota is also a 429 but is a billing failure that won't clear
+    return (
+        getattr(error, "status_code", None) == 429
+        and getattr(error, "code", None) != "insufficient_quota"
+    )
+
+def parse_reset_duration(value):
+    # Rate limit reset headers look like "1s", "6m0s" or "120ms"
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value or ""))
+
+class RateLimiter:
+    """Delays new requests when the API reports its request quota is nearly spent."""
+
+    def __init__(self, threshold=RATE_LIMIT_REMAINING_THRESHOLD):
+        self.threshold = threshold
+        self.resume_at = 0.0
+
+    async def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def update(self, headers):
+        retry_after = headers.get("retry-after")
+        if retry_after and retry_after.replace(".", "", 1).isdigit():
+            self.pause(float(retry_after))
+            return
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None and int(remaining) < self.threshold:
+            self.pause(parse_reset_duration(headers.get("x-ratelimit-reset-requests")) or 1)
+
+@retry(
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception(is_rate_limit_error),
+    reraise=True,
+)
+async def request_completion(client, rate_limiter, **kwargs):
+    await rate_limiter.wait()
+    try:
+        raw_response = await client.chat.completions.with_raw_response.create(**kwargs)
+    except Exception as e:
+        if is_rate_limit_error(e):
+            rate_limiter.update(e.response.headers)
+        raise
+    rate_limiter.update(raw_response.headers)
+    return raw_response.parse()
+
+def build_chat_request(question):
+    return {
+        "model": "gpt-4",
+        "messages": [
+            {"role": "system", "content": "You are a domain expert providing factual, concise answers. Never mention AI, LLMs, or language models in your responses. Never say 'As an AI' or similar phrases. Respond in a natural, human-like manner with factual information only."},
+            {"role": "user", "content": question}
+        ],
+        "max_tokens": 150,
+    }
+
+async def get_gpt_answer(question, client, semaphore, rate_limiter, placeholder):
+    async with semaphore:
+        try:
+            # Stream tokens into the page as they arrive rather than waiting
+            # for the whole completion
+            stream = await request_completion(client, rate_limiter, stream=True, **build_chat_request(question))
+            chunks = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    placeholder.markdown(f"**Answer:** {''.join(chunks)}")
+            return "".join(chunks).strip()
+        except Exception as e:
+            st.error(f"Error generating answer: {str(e)}")
+            return "Unable to generate an answer. Please check your API key and try again."
+
+async def generate_answers(questions, openai, api_key, progress_bar, placeholders):
+    # Answers are independent, so fire them concurrently and let the
+    # semaphore cap how many requests are in flight at once
+    # Retries are handled by request_completion, so disable the client's own.
+    # All requests share one HTTP/2 connection pool; the async pool is tied to
+    # this event loop, so it is created per run and closed with the client.
+    http_client = openai.DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=MAX_CONCURRENT_REQUESTS,
+            max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+        ),
+    )
+    client = openai.AsyncOpenAI(api_key=api_key, max_retries=0, http_client=http_client)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    rate_limiter = RateLimiter()
+    completed = 0
+
+    async def answer(question, placeholder):
+        nonlocal completed
+        result = await get_gpt_answer(question, client, semaphore, rate_limiter, placeholder)
+        placeholder.markdown(f"**Answer:** {result}")
+        completed += 1
+        progress_bar.progress(completed / len(questions))
+        return result
 
-def get_gpt_answer(question, openai):
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a domain expert providing factual, concise answers. Never mention AI, LLMs, or language models in your responses. Never say 'As an AI' or similar phrases. Respond in a natural, human-like manner with factual information only."},
-                {"role": "user", "content": question}
-            ],
-            max_tokens=150
+        answers = await asyncio.gather(*(answer(q, p) for q, p in zip(questions, placeholders)))
+    finally:
+        await client.close()
+    return list(zip(questions, answers))
+
+# Keep-alive connection pool reused by synchronous API calls across reruns,
+# so batch uploads and status polls skip repeated TCP/TLS handshakes
+@st.cache_resource(show_spinner=False)
+def get_http_client(_openai):
+    return _openai.DefaultHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+    )
+
+def submit_answers_batch(questions, openai, api_key):
+    # The Batch API runs at half the price of real-time calls but may take
+    # up to a day; returns the batch id, or None if submission failed
+    client = openai.OpenAI(api_key=api_key, http_client=get_http_client(openai))
+    batch_input = "\n".join(
+        json.dumps({
+            "custom_id": f"q{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": build_chat_request(question),
+        })
+        for i, question in enumerate(questions)
+    )
+    try:
+        input_file = client.files.create(file=("questions.jsonl", batch_input.encode("utf-8")), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
         )
-        return response.choices[0].message.content.strip()
     except Exception as e:
-        st.error(f"Error generating answer: {str(e)}")
-        return "Unable to generate an answer. Please check your API key and try again."
+        st.error(f"Error submitting batch: {str(e)}")
+        return None
+    return batch.id
+
+def check_answers_batch(batch_id, questions, openai, api_key):
+    # Checks the job once without blocking the script. Returns the batch
+    # status and, once the job has finished, the question/answer pairs.
+    # Returns (None, None) if the check fails, so the caller keeps the job.
+    client = openai.OpenAI(api_key=api_key, http_client=get_http_client(openai))
+    try:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status not in ("completed", "failed", "expired", "cancelled"):
+            return batch.status, None
+
+        answers = {}
+        if batch.output_file_id:
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                result = json.loads(line)
+                choices = ((result.get("response") or {}).get("body") or {}).get("choices")
+                if choices:
+                    answers[result["custom_id"]] = choices[0]["message"]["content"].strip()
+    except Exception as e:
+        st.error(f"Error checking batch {batch_id}: {str(e)}")
+        return None, None
+
+    if batch.status != "completed" or len(answers) < len(questions):
+        st.error(f"Batch {batch.id} finished with status '{batch.status}'; some answers could not be generated.")
+
+    fallback = "Unable to generate an answer. Please check your API key and try again."
+    return batch.status, [(question, answers.get(f"q{i}", fallback)) for i, question in enumerate(questions)]
+
+def layout_answers(questions):
+    # Reserve the status line and download button above the answers, and lay
+    # out the answers up front so they can be filled in as they are generated
+    status_slot = st.empty()
+    download_slot = st.empty()
+    st.subheader("Generated Answers")
+    answer_slots = []
+    for i, q in enumerate(questions, 1):
+        st.markdown(f"**Question {i}:** {q}")
+        answer_slots.append(st.empty())
+        st.markdown("---")
+    return status_slot, download_slot, answer_slots
+
+def offer_download(download_slot, questions_answers):
+    output_file = save_to_docx(questions_answers, io.BytesIO())
+    download_slot.download_button(
+        label="Download Q&A Document",
+        data=output_file.getvalue(),
+        file_name="Document_QA.docx",
+        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    )
 
 def save_to_docx(questions_answers, output_file):
     doc = Document()
@@ -264,11 +633,9 @@ def main():
     # API key status
     if validate_api_key(current_api_key):
         st.sidebar.success("✅ API Key configured")
-        openai.api_key = current_api_key
     else:
         st.warning("Please enter your OpenAI API key to proceed.")
         st.sidebar.error("❌ API Key not configured")
-        openai.api_key = None
     
     # File uploader
     uploaded_file = st.file_uploader("Upload a document", type=["pdf", "docx"])
@@ -280,61 +647,75 @@ def main():
         if file_type == "pdf" and not tesseract_available:
             st.warning("⚠️ Note: Scanned PDFs cannot be processed because Tesseract OCR is not installed. Text-based PDFs will still work.")
             
-        # Save the uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_type}') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            temp_file_path = tmp_file.name
-        
-        try:
-            with st.spinner("Processing document..."):
-                # Extract questions from document
-                full_text = get_document_text(temp_file_path, file_type)
-                questions = extract_questions(full_text)
+        file_bytes = uploaded_file.getvalue()
+        file_hash = hashlib.sha256(file_bytes).hexdigest()
+
+        with st.spinner("Processing document..."):
+            # Extract questions from document
+            try:
+                full_text = get_cached_document_text(file_hash, file_type, file_bytes)
+            except ExtractionError as e:
+                st.error(str(e))
+                full_text = ""
+            questions = extract_questions(full_text)
+            
+            if not questions:
+                st.warning("No questions were extracted from the document.")
+            else:
+                st.subheader(f"Extracted Questions ({len(questions)})")
+                for i, q in enumerate(questions, 1):
+                    st.write(f"**Q{i}:** {q}")
                 
-                if not questions:
-                    st.warning("No questions were extracted from the document.")
-                else:
-                    st.subheader(f"Extracted Questions ({len(questions)})")
-                    for i, q in enumerate(questions, 1):
-                        st.write(f"**Q{i}:** {q}")
-                    
-                    # Generate answers button
-                    if st.button("Generate Expert Answers"):
+                # Generate answers button
+                batch_mode = st.checkbox(
+                    "Batch mode (cheaper)",
+                    help="Submit all questions through OpenAI's Batch API at half the cost. "
+                         "Results can take up to 24 hours. The pending batch is tracked for this "
+                         "browser session only; reloading the page loses track of it."
+                )
+                # Only one batch at a time, so a second click can't submit
+                # (and pay for) a job that replaces the pending one
+                batch_pending = st.session_state.batch_job is not None
+                if batch_mode and batch_pending:
+                    st.info("A batch is already pending. Check its status below before submitting another.")
+                if st.button("Generate Expert Answers", disabled=batch_mode and batch_pending):
+                    if batch_mode:
+                        batch_id = submit_answers_batch(questions, openai, current_api_key)
+                        if batch_id:
+                            # Kept in the session so reruns keep checking the
+                            # job instead of orphaning it
+                            st.session_state.batch_job = {"id": batch_id, "questions": questions}
+                    else:
                         with st.spinner("Generating answers..."):
-                            questions_answers = []
-                            progress_bar = st.progress(0)
-                            
-                            for i, question in enumerate(questions):
-                                answer = get_gpt_answer(question, openai)
-                                questions_answers.append((question, answer))
-                                progress_bar.progress((i + 1) / len(questions))
-                            
-                            # Save to DOCX
-                            output_file = tempfile.NamedTemporaryFile(delete=False, suffix='.docx').name
-                            save_to_docx(questions_answers, output_file)
-                            
-                            # Display download button
-                            with open(output_file, "rb") as file:
-                                btn = st.download_button(
-                                    label="Download Q&A Document",
-                                    data=file,
-                                    file_name="Document_QA.docx",
-                                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                                )
-                            
-                            # Display answers
-                            st.subheader("Generated Answers")
-                            for i, (q, a) in enumerate(questions_answers, 1):
-                                st.markdown(f"**Question {i}:** {q}")
-                                st.markdown(f"**Answer:** {a}")
-                                st.markdown("---")
-        
-        finally:
-            # Clean up the temp file
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
+                            status_slot, download_slot, answer_slots = layout_answers(questions)
+                            progress_bar = status_slot.progress(0)
+                            questions_answers = asyncio.run(
+                                generate_answers(questions, openai, current_api_key, progress_bar, answer_slots)
+                            )
+                            offer_download(download_slot, questions_answers)
+
+    # Check any Batch API job submitted earlier in this session. This runs
+    # once per script run rather than sleeping in a loop, so the rest of the
+    # page still renders and widgets stay responsive while the job is pending.
+    batch_job = st.session_state.batch_job
+    if batch_job and validate_api_key(current_api_key):
+        status, questions_answers = check_answers_batch(
+            batch_job["id"], batch_job["questions"], openai, current_api_key
+        )
+        if questions_answers is None:
+            if status:
+                st.info(
+                    f"Batch {batch_job['id']} is {status.replace('_', ' ')}. "
+                    "Keep this page open; reloading it loses track of the batch."
+                )
+            # Clicking reruns the script, which checks the job again
+            st.button("Check batch status")
+        else:
+            st.session_state.batch_job = None
+            _, download_slot, answer_slots = layout_answers(batch_job["questions"])
+            for slot, (_, a) in zip(answer_slots, questions_answers):
+                slot.markdown(f"**Answer:** {a}")
+            offer_download(download_slot, questions_answers)
 
     # API Key instructions
     with st.sidebar.expander("How to get an API Key"):
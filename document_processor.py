@@ -1,6 +1,6 @@
 import re
 import pdfplumber
-import pytesseract
+from tesserocr import PyTessBaseAPI
 from pdf2image import convert_from_path
 from docx import Document
 import openai
@@ -19,26 +19,28 @@ load_dotenv()
 def extract_text_with_ocr(pdf_path):
     try:
         images = convert_from_path(pdf_path)
-        full_text = ""
-        for image in images:
-            full_text += pytesseract.image_to_string(image) + "\n"
-        return full_text
+        parts = []
+        with PyTessBaseAPI(lang='eng') as api:
+            for image in images:
+                api.SetImage(image)
+                parts.append(api.GetUTF8Text() + "\n")
+        return "".join(parts)
     except Exception as e:
         st.error(f"Error processing PDF with OCR: {str(e)}")
         return ""
 
 # Function to extract text from a selectable text PDF
 def extract_text_from_pdf(pdf_path):
-    text = ""
+    parts = []
     try:
         with pdfplumber.open(pdf_path) as pdf:
             for page in pdf.pages:
                 extracted_text = page.extract_text()
                 if extracted_text:
-                    text += extracted_text + "\n"
+                    parts.append(extracted_text + "\n")
     except Exception as e:
         st.error(f"Error extracting text from PDF: {str(e)}")
-    return text
+    return "".join(parts)
 
 # Function to determine if the PDF is scanned or text-based
 def get_pdf_text(pdf_path):
@@ -54,10 +56,7 @@ def get_pdf_text(pdf_path):
 def extract_text_from_docx(docx_path):
     try:
         doc = Document(docx_path)
-        text = "" 
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-        return text
+        return "".join(para.text + "\n" for para in doc.paragraphs)
     except Exception as e:
         st.error(f"Error extracting text from DOCX: {str(e)}")
         return ""
@@ -85,7 +84,7 @@ def extract_questions_from_docx(docx_path):
 # Update the OpenAI API key configuration
 def generate_answers(questions, api_key=None):
     # Use config API key if none provided
-    openai.api_key = api_key or config.OPENAI_API_KEY
+    client = openai.OpenAI(api_key=api_key or config.OPENAI_API_KEY)
     qa_pairs = []
     
     progress_bar = st.progress(0)
@@ -94,7 +93,7 @@ def generate_answers(questions, api_key=None):
     for i, question in enumerate(questions):
         status_text.text(f"Generating answer for question {i+1} of {len(questions)}")
         try:
-            response = openai.ChatCompletion.create(
+            response = client.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "You are a domain expert providing factual, concise answers. Never mention AI, LLMs, or language models in your responses. Never say 'As an AI' or similar phrases. Respond in a natural, human-like manner with factual information only."},
@@ -0,0 +1,39 @@
+import pypdfium2 as pdfium
+
+# Functions in this module run inside worker processes. They are kept out of
+# app.py so the pool can import them without re-running the Streamlit script.
+
+# Document opened by open_worker_pdf, one per worker process
+worker_pdf = None
+
+def read_page_text(pdf, index):
+    page = pdf[index]
+    textpage = page.get_textpage()
+    text = textpage.get_text_range()
+    textpage.close()
+    page.close()
+    # PDFium separates lines with CRLF
+    return text.replace("\r\n", "\n")
+
+def open_worker_pdf(pdf_bytes):
+    # Pool initializer: document handles can't be pickled, so each worker
+    # opens its own copy from the raw bytes once
+    global worker_pdf
+    worker_pdf = pdfium.PdfDocument(pdf_bytes)
+
+def extract_one_page(index):
+    return read_page_text(worker_pdf, index)
+
+# Tesseract API created by init_ocr_worker, one per worker process
+ocr_api = None
+
+def init_ocr_worker(language):
+    # Pool initializer: load the language model once and keep it resident
+    # for every page this worker handles, across uploads
+    global ocr_api
+    import tesserocr
+    ocr_api = tesserocr.PyTessBaseAPI(lang=language)
+
+def ocr_one_page(image):
+    ocr_api.SetImage(image)
+    return ocr_api.GetUTF8Text()